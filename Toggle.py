@@ -8,110 +8,869 @@ Needs Python 3.11 to work:
 '''
 
 import os
+import re
 import sys
+import time
+import queue
+import struct
+import json
+import getpass
+import hashlib
+import shutil
+import stat
+import asyncio
+import contextlib
+import threading
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import numpy as np
-from pydub import AudioSegment
+from numpy.lib.stride_tricks import sliding_window_view
 import tempfile
 
 # ======================== CONFIG TOGGLE ========================
-MODE = "isolate"   # "isolate"(isolates drums) or "silence"(silence drums)
+MODE = "isolate"   # "isolate"(isolates drums), "silence"(silence drums), "labels"(mark hits on a label track),
+                   # "split"(split clips at hits) or "toggle"(drums and residual rendered once, then alternated)
 WINDOW_MS = 60     # same window for both modes (centered on peak)
 PRE_FADE_MS = 20   # for "silence" mode
 POST_FADE_MS = 20  # for "silence" mode
+FLOAT_OUTPUT = False  # render in float32 and hand Audacity 32-bit float WAVs (no rounding or clipping)
+EXPORT_CHANNELS = None  # None = the project's own channel count, 1 = mono mixdown (original behaviour), 2 = stereo (mono upmixed)
+EDIT_IN_PLACE = False  # for "silence" mode: edit the track inside Audacity instead of importing a rendered copy
+TOGGLE_RERENDER = False  # for "toggle" mode: render fresh stems even if the tracks look unchanged (after audio edits)
 THRESHOLD = 0.7    # peak detect threshold (0..1)
 MIN_DISTANCE = 1000  # samples between peaks
+DETECT_MEMORY_MB = 64  # working-memory cap for streaming peak detection
+DETECTOR = "amplitude"  # "amplitude"(raw sample threshold), "adaptive"(local threshold) or "flux"(spectral-flux onsets)
+ADAPTIVE_RATIO = 0.7        # for "adaptive": fraction of the local envelope maximum (0..1)
+ADAPTIVE_WINDOW_MS = 2000   # for "adaptive": span of the running maximum, centred on each sample
+ADAPTIVE_FLOOR = 0.05       # for "adaptive": never trigger below this fraction of full scale
+FLUX_THRESHOLD = 0.2    # onset threshold for "flux", relative to the strongest onset (0..1)
+DRUM_CLASSES = None     # None(all hits) or a subset of ("kick", "snare", "hat") to isolate/silence
+DRUM_BANDS = (("kick", 20, 150), ("snare", 150, 2500), ("hat", 5000, 20000))  # name, Hz range
+SPLIT_BATCH = 2000  # for "split" mode: hits per pipelined batch (one progress line each)
+ALL_TRACKS = False  # process every wave track on its own instead of the mixed-down project
+DSP_WORKERS = None  # processes for ALL_TRACKS detection/rendering (None = one per CPU)
+EXCHANGE_DIR = None  # where Toggle and Audacity swap files; None = /dev/shm if present, else the system temp dir
+RESPONSE_MAX_MB = 64        # largest reply accepted from Audacity
+RESPONSE_TIMEOUT_S = 120    # give up if a reply takes longer than this
 # ===============================================================
 
 # ---------- Audacity pipe setup ----------
 if sys.platform == 'win32':
-    print("Running on Windows")
     TONAME = '\\\\.\\pipe\\ToSrvPipe'
     FROMNAME = '\\\\.\\pipe\\FromSrvPipe'
     EOL = '\r\n\0'
 else:
-    print("Running on Linux or macOS")
     TONAME = f'/tmp/audacity_script_pipe.to.{os.getuid()}'
     FROMNAME = f'/tmp/audacity_script_pipe.from.{os.getuid()}'
     EOL = '\n'
 
-print(f'Write to  "{TONAME}"')
-if not os.path.exists(TONAME):
-    print(" ..does not exist. Ensure Audacity is running with mod-script-pipe.")
-    sys.exit()
+class AudacityPipe:
+    # The two mod-script-pipe files, opened on first use and kept open for the process
+    def __init__(self, toname=TONAME, fromname=FROMNAME, eol=EOL):
+        self.toname = toname
+        self.fromname = fromname
+        self.eol = eol
+        self.tofile = None
+        self.fromfile = None
 
-print(f'Read from "{FROMNAME}"')
-if not os.path.exists(FROMNAME):
-    print(" ..does not exist. Ensure Audacity is running with mod-script-pipe.")
-    sys.exit()
+    def connect(self):
+        if self.tofile is not None:
+            return self
+        print("Running on Windows" if sys.platform == 'win32' else "Running on Linux or macOS")
+        for label, name in (("Write to ", self.toname), ("Read from", self.fromname)):
+            print(f'{label} "{name}"')
+            if not os.path.exists(name):
+                print(" ..does not exist. Ensure Audacity is running with mod-script-pipe.")
+                raise ConnectionError(f"{name} does not exist")
+        print("-- Both pipes exist. Good.")
+        tofile = open(self.toname, 'w')
+        print("-- File to write to has been opened")
+        self.fromfile = open(self.fromname, 'rt')
+        self.tofile = tofile
+        print("-- File to read from has now been opened too\r\n")
+        return self
 
-print("-- Both pipes exist. Good.")
-TOFILE = open(TONAME, 'w')
-print("-- File to write to has been opened")
-FROMFILE = open(FROMNAME, 'rt')
-print("-- File to read from has now been opened too\r\n")
+PIPE = AudacityPipe()
 
 def send_command(command):
     print("Send: >>>\n" + command)
-    TOFILE.write(command + EOL)
-    TOFILE.flush()
+    pipe = PIPE.connect()
+    pipe.tofile.write(command + pipe.eol)
+    pipe.tofile.flush()
 
 def get_response():
-    result = ''
-    line = ''
-    while True:
-        result += line
-        line = FROMFILE.readline()
-        if line == '\n' and len(result) > 0:
-            break
-    return result
+    return _response_reader(PIPE.connect().fromfile).read()
+
+class ResponseReader:
+    # Reads replies in raw chunks into a bytearray and scans only the new bytes for the
+    # blank-line terminator, so a reply costs O(size) instead of one string copy per line.
+    # A pump thread does the blocking reads, which lets read() enforce a deadline on any
+    # platform. last_bytes / last_seconds describe the most recent reply. A reply that times
+    # out or overflows is still owed by the pipe, so it is skipped when it turns up.
+    TERMINATOR = re.compile(rb'\n\r?\n')
+
+    def __init__(self, fromfile, max_bytes=None, timeout=None, chunk_size=65536):
+        self.fd = fromfile.fileno()
+        self.max_bytes = max_bytes if max_bytes is not None else int(RESPONSE_MAX_MB * 1024 * 1024)
+        self.timeout = timeout if timeout is not None else RESPONSE_TIMEOUT_S
+        self.chunk_size = chunk_size
+        self.last_bytes = 0
+        self.last_seconds = 0.0
+        self._buffer = bytearray()
+        self._start = 0
+        self._scanned = 0
+        self._chunks = queue.Queue()
+        self._eof = False
+        self._skip = 0  # replies still owed by the pipe that nobody is waiting for
+        self._pump = None
+
+    def _pump_loop(self):
+        while True:
+            chunk = os.read(self.fd, self.chunk_size)
+            self._chunks.put(chunk)
+            if not chunk:
+                return
+
+    def _fill(self, deadline):
+        if self._eof:
+            raise EOFError("Audacity closed the pipe")
+        if self._pump is None:
+            self._pump = threading.Thread(target=self._pump_loop, daemon=True)
+            self._pump.start()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._skip += 1
+            raise TimeoutError(f"no complete reply from Audacity within {self.timeout}s")
+        try:
+            chunk = self._chunks.get(timeout=remaining)
+        except queue.Empty:
+            self._skip += 1  # the late reply must not answer the next command
+            raise TimeoutError(f"no complete reply from Audacity within {self.timeout}s") from None
+        if not chunk:
+            self._eof = True
+            raise EOFError("Audacity closed the pipe")
+        self._buffer += chunk
+
+    def read(self):
+        # One reply: everything up to the blank line that follows a non-empty body.
+        # Consumed replies only advance _start; the buffer is compacted once half of it is stale.
+        t0 = time.monotonic()
+        deadline = t0 + self.timeout
+        while True:
+            match = self.TERMINATOR.search(self._buffer, max(self._scanned - 2, self._start))
+            if match:
+                body = bytes(self._buffer[self._start:match.start() + 1])
+                self._start = self._scanned = match.end()
+                if self._start > len(self._buffer) // 2:
+                    del self._buffer[:self._start]
+                    self._start = self._scanned = 0
+                if self._skip:  # late or oversized reply from an earlier read
+                    self._skip -= 1
+                    continue
+                if len(body) > self.max_bytes:
+                    raise ValueError(f"Audacity reply exceeded {self.max_bytes} bytes")
+                self.last_bytes = len(body)
+                self.last_seconds = time.monotonic() - t0
+                return body.decode('utf-8', errors='replace').replace('\r\n', '\n')
+            self._scanned = len(self._buffer)
+            if len(self._buffer) - self._start > self.max_bytes:
+                # drop it and skip the rest on the next read, so replies stay in step
+                self._buffer.clear()
+                self._start = self._scanned = 0
+                self._skip += 1
+                raise ValueError(f"Audacity reply exceeded {self.max_bytes} bytes")
+            self._fill(deadline)
+
+_READERS = {}
+
+def _response_reader(fromfile):
+    # One reader per pipe: its pump thread owns every byte coming out of it
+    reader = _READERS.get(id(fromfile))
+    if reader is None or reader.fd != fromfile.fileno():
+        reader = _READERS[id(fromfile)] = ResponseReader(fromfile)
+    return reader
 
 def do_command(command):
     send_command(command)
     response = get_response()
-    print("Rcvd: <<<\n" + response)
+    reader = _response_reader(PIPE.fromfile)
+    print(f"Rcvd: <<< ({reader.last_bytes} bytes, {reader.last_seconds * 1000:.1f} ms)\n" + response)
     return response
 
+# ---------- Pipelined Audacity client ----------
+class AsyncPipeClient:
+    # Commands are written back-to-back without waiting for replies; a reader thread
+    # frames the replies and hands them to the awaiting callers in FIFO order (the pipe
+    # answers strictly in order). Queued commands are coalesced into one write, and
+    # reads run on their own thread so a full pipe in one direction never stalls the other.
+    def __init__(self, tofile=None, fromfile=None, eol=None, max_in_flight=1024, verbose=False):
+        if tofile is None or fromfile is None:
+            pipe = PIPE.connect()
+            tofile, fromfile, eol = tofile or pipe.tofile, fromfile or pipe.fromfile, eol or pipe.eol
+        self.tofile = tofile
+        self.fromfile = fromfile
+        self.eol = eol if eol is not None else EOL
+        self.max_in_flight = max_in_flight
+        self.verbose = verbose
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._loop = None
+        self._waiting = deque()
+        self._outbox = []
+        self._flushing = False
+        self._slots = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _start(self):
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._expected = threading.Semaphore(0)
+        self._responses = _response_reader(self.fromfile)
+        self._lock = threading.Lock()
+        self._inbox = []
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def _read_loop(self):
+        # Reads exactly one reply per command sent, so it never sits on the pipe after close.
+        # Replies are handed over in bunches: only the first one of a bunch wakes the loop.
+        while True:
+            self._expected.acquire()
+            if self._closed:
+                return
+            try:
+                reply = (self._responses.read(), None)
+            except Exception as e:
+                reply = (None, e)
+            with self._lock:
+                self._inbox.append(reply)
+                wake = len(self._inbox) == 1
+            if wake:
+                self._loop.call_soon_threadsafe(self._drain)
+            if reply[1] is not None:
+                return
+
+    def _drain(self):
+        with self._lock:
+            replies, self._inbox = self._inbox, []
+        for response, error in replies:
+            if error is not None:
+                # the reader thread has stopped: fail everything in flight and every later send.
+                # The reader already skips the reply that failed; the ones queued behind it are
+                # still owed by the pipe too, so it skips those as well.
+                self._error = error
+                self._responses._skip += max(len(self._waiting) - 1, 0)
+                while self._waiting:
+                    future = self._waiting.popleft()
+                    self._slots.release()
+                    if not future.cancelled():
+                        future.set_exception(error)
+                return
+            future = self._waiting.popleft()
+            self._slots.release()
+            if not future.cancelled():
+                future.set_result(response)
+
+    def _write(self, data):
+        self.tofile.write(data)
+        self.tofile.flush()
+
+    async def _flush(self):
+        while self._outbox:
+            data = ''.join(self._outbox)
+            self._outbox.clear()
+            await self._loop.run_in_executor(self._writer, self._write, data)
+        self._flushing = False
+
+    async def _queue(self, command):
+        if self._loop is None:
+            self._start()
+        if self._error is not None:
+            raise self._error
+        await self._slots.acquire()
+        if self._error is not None:
+            self._slots.release()
+            raise self._error
+        future = self._loop.create_future()
+        self._waiting.append(future)  # same order as the outbox below
+        self._outbox.append(command + self.eol)
+        self._expected.release()
+        if not self._flushing:
+            self._flushing = True
+            self._loop.create_task(self._flush())
+        if self.verbose:
+            print("Send: >>>\n" + command)
+        return future
+
+    async def send(self, command):
+        # Queue one command; resolves to its reply once every earlier reply has arrived
+        response = await (await self._queue(command))
+        if self.verbose:
+            print("Rcvd: <<<\n" + response)
+        return response
+
+    async def send_many(self, commands):
+        # Pipelines a whole batch; replies come back in command order
+        futures = [await self._queue(c) for c in commands]
+        return list(await asyncio.gather(*futures))
+
+    async def close(self):
+        self._writer.shutdown(wait=True)
+        if self._loop is not None:
+            self._closed = True
+            self._expected.release()
+            await self._loop.run_in_executor(None, self._thread.join)
+            self._loop = None
+
+def do_commands(commands, max_in_flight=1024):
+    # Blocking convenience wrapper: pipelines commands and returns their replies in order
+    async def run():
+        async with AsyncPipeClient(max_in_flight=max_in_flight) as client:
+            return await client.send_many(commands)
+    return asyncio.run(run())
+
+# ---------- Decode-once pipeline ----------
+class DecodedAudio:
+    # The exported WAV decoded once; detection and rendering both read from this buffer.
+    # samples are interleaved and signed; 24-bit audio is kept as sign-extended int32 values
+    # with sample_width 3. Float WAVs also keep their original values in floats, for the
+    # float render path.
+    def __init__(self, samples, frame_rate, sample_width, channels, floats=None):
+        self.samples = samples
+        self.floats = floats
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.total_ms = round(1000 * (len(samples) // channels) / frame_rate)
+        self._envelope = None
+        self._pyramid = None
+
+    @classmethod
+    def from_segment(cls, audio):
+        return cls(np.array(audio.get_array_of_samples()), audio.frame_rate, audio.sample_width,
+                   audio.channels)
+
+    @classmethod
+    def from_file(cls, path):
+        # PCM/float WAV straight from the data chunk, anything else through pydub
+        native = _read_wav_samples(path)
+        if native is None:
+            from pydub import AudioSegment  # only this fallback needs pydub (and ffmpeg)
+            return cls.from_segment(AudioSegment.from_file(path))
+        samples, frame_rate, sample_width, channels, floats = native
+        return cls(samples, frame_rate, sample_width, channels, floats=floats)
+
+    def frames_float32(self, start=0, stop=None):
+        # A fresh frames x channels float32 copy scaled to -1..1, for the float render path.
+        # Float sources are copied as they are, without the round trip through int32.
+        if self.floats is not None:
+            return self.floats.reshape(-1, self.channels)[start:stop].astype(np.float32)
+        frames = self.samples.reshape(-1, self.channels)[start:stop].astype(np.float32)
+        frames *= np.float32(1.0 / 2 ** (8 * self.sample_width - 1))
+        return frames
+
+    def envelope(self):
+        # What amplitude detection looks at, one value per frame (see _frame_envelope)
+        if self.channels == 1:
+            return self.samples
+        if self._envelope is None:
+            self._envelope = _frame_envelope(self.samples, self.channels)
+        return self._envelope
+
+    def pyramid(self):
+        # Built on first use and kept, so re-detecting with another threshold is cheap
+        if self._pyramid is None:
+            self._pyramid = PeakPyramid.build(self.envelope())
+        return self._pyramid
+
+def _frame_envelope(samples, channels):
+    # The samples themselves for mono, else the max |sample| across channels, built one
+    # channel at a time so it never needs more than two frame-length buffers
+    if channels == 1:
+        return samples
+    frames = samples.reshape(-1, channels)
+    env = np.abs(frames[:, 0])
+    for c in range(1, channels):
+        np.maximum(env, np.abs(frames[:, c]), out=env)
+    return env
+
 # ---------- Peak detection ----------
 def detect_peaks(audio_file, threshold=0.7, min_distance=1000):
-    audio = AudioSegment.from_file(audio_file)
-    samples = np.abs(np.array(audio.get_array_of_samples()))
-    bit_depth = audio.sample_width * 8
+    return detect_peaks_decoded(DecodedAudio.from_file(audio_file), threshold, min_distance)
+
+def detect_peaks_decoded(decoded, threshold=0.7, min_distance=1000):
+    bit_depth = decoded.sample_width * 8
     max_amplitude = (2 ** (bit_depth - 1)) - 1
     thr_value = threshold * max_amplitude
-    threshold_peaks = np.where(samples > thr_value)[0]
+    threshold_peaks = decoded.pyramid().crossings(decoded.envelope(), thr_value)
+    return _pick_peaks(threshold_peaks, min_distance), decoded.frame_rate
 
+def _pick_peaks(crossings, min_distance, last_peak=None):
+    # Greedy "first crossing, then skip min_distance", same as walking every crossing in
+    # order. Each accepted peak jumps straight to the next eligible crossing with a binary
+    # search, so the Python loop runs once per peak instead of once per crossing.
+    # last_peak carries the state over from a previous block of the same stream.
+    if last_peak is None:
+        last_peak = -min_distance  # so sample 0 never wins, as in the original loop
+    crossings = np.asarray(crossings)
+    n = len(crossings)
     peaks = []
-    last_peak = -min_distance
-    for p in threshold_peaks:
-        if p - last_peak > min_distance:
-            peaks.append(p)
-            last_peak = p
-    return peaks, audio.frame_rate
+    i = crossings.searchsorted(last_peak + min_distance, side='right')
+    while i < n:
+        p = crossings[i]
+        peaks.append(p)
+        i = crossings.searchsorted(p + min_distance, side='right')
+    return peaks
+
+# ---------- Max-abs envelope pyramid ----------
+class PeakPyramid:
+    # max |sample| per `base` samples, then per base * factor, ... each level a
+    # reshape-and-max of the one below. Threshold searches start at the coarsest level
+    # and only descend into blocks whose maximum exceeds the threshold.
+    def __init__(self, levels, length, base=256, factor=16):
+        self.levels = levels  # finest first
+        self.length = length
+        self.base = base
+        self.factor = factor
+
+    @classmethod
+    def build(cls, samples, base=256, factor=16):
+        levels = [_block_envelope(samples, base)]
+        while len(levels[-1]) > factor:
+            lower = levels[-1]
+            padded = np.concatenate((lower, np.zeros(-len(lower) % factor, dtype=lower.dtype)))
+            levels.append(padded.reshape(-1, factor).max(axis=1))
+        return cls(levels, len(samples), base, factor)
+
+    def candidate_blocks(self, thr_value):
+        # Indices of finest-level blocks whose max exceeds thr_value
+        top = self.levels[-1]
+        idx = np.flatnonzero(top > thr_value)
+        for level in reversed(self.levels[:-1]):
+            idx = (idx[:, None] * self.factor + np.arange(self.factor)).ravel()
+            idx = idx[idx < len(level)]
+            idx = idx[level[idx] > thr_value]
+        return idx
+
+    def crossings(self, samples, thr_value):
+        # Same as np.flatnonzero(np.abs(samples) > thr_value), scanning candidate blocks only.
+        # Gathering costs several times a plain pass per sample, so once the candidates cover
+        # a fifth of the track (dense, limited material) the plain pass is used instead.
+        blocks = self.candidate_blocks(thr_value)
+        if len(blocks) * self.base > self.length // 5:
+            return np.flatnonzero(np.abs(samples) > thr_value)
+        starts = blocks * self.base
+        idx = _ragged_arange(starts, np.minimum(self.base, self.length - starts))
+        return idx[np.abs(samples[idx]) > thr_value]
+
+# ---------- Adaptive-threshold detection ----------
+def _running_max(x, width):
+    # Centred moving maximum in O(n) (van Herk / Gil-Werman): per-block prefix and
+    # suffix maxima, so every window is the max of one suffix and one prefix value
+    n = len(x)
+    if width <= 1 or n == 0:
+        return x.copy()
+    half = width // 2
+    padded = np.concatenate((np.zeros(half, dtype=x.dtype), x,
+                             np.zeros(width - half + (-(n + width) % width), dtype=x.dtype)))
+    blocks = padded.reshape(-1, width)
+    prefix = np.maximum.accumulate(blocks, axis=1).ravel()
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    i = np.arange(n)
+    return np.maximum(suffix[i], prefix[i + width - 1])
+
+def _block_envelope(samples, decimation):
+    # Max |sample| per block of decimation samples (last block may be partial)
+    n = len(samples)
+    nb = -(-n // decimation)
+    full = (n // decimation) * decimation
+    env = np.empty(nb, dtype=np.int64)
+    if full:
+        blocks = samples[:full].reshape(-1, decimation)
+        env[:full // decimation] = np.maximum(blocks.max(axis=1), -blocks.min(axis=1).astype(np.int64))
+    if full < n:
+        tail = samples[full:]
+        env[-1] = max(int(tail.max()), -int(tail.min()))
+    return env
+
+def detect_peaks_adaptive(audio_file, ratio=0.7, min_distance=1000, window_ms=2000, floor=0.05,
+                          decimation=256):
+    return detect_peaks_adaptive_decoded(DecodedAudio.from_file(audio_file), ratio, min_distance,
+                                         window_ms, floor, decimation)
+
+def detect_peaks_adaptive_decoded(decoded, ratio=0.7, min_distance=1000, window_ms=2000, floor=0.05,
+                                  decimation=256):
+    # Like detect_peaks, but the threshold is ratio * the running max of the rectified
+    # envelope over window_ms, so quiet intros and loud choruses both yield hits.
+    # The statistic runs on a max-abs envelope decimated by `decimation` samples.
+    samples = decoded.envelope()
+    n = len(samples)
+    if n == 0:
+        return [], decoded.frame_rate
+    max_amplitude = (2 ** (decoded.sample_width * 8 - 1)) - 1
+    pyramid = decoded._pyramid  # reuse its finest level if an earlier detection built one
+    if pyramid is not None and decimation == pyramid.base:
+        env = pyramid.levels[0]
+    else:
+        env = _block_envelope(samples, decimation)
+    width = max(1, int(round(window_ms * decoded.frame_rate / 1000.0 / decimation)))
+    thr = np.maximum(ratio * _running_max(env, width), floor * max_amplitude)
+
+    # Compare every sample against its block's threshold without upsampling it
+    full = (n // decimation) * decimation
+    crossings = np.flatnonzero(np.abs(samples[:full]).reshape(-1, decimation) > thr[:full // decimation, None])
+    if full < n:
+        tail = np.flatnonzero(np.abs(samples[full:]) > thr[-1]) + full
+        crossings = np.concatenate((crossings, tail))
+    return _pick_peaks(crossings, min_distance), decoded.frame_rate
+
+# ---------- Spectral-flux onset detection ----------
+def _mono_float(decoded):
+    # Channel-averaged samples scaled to -1..1
+    full_scale = float(2 ** (decoded.sample_width * 8 - 1))
+    x = decoded.samples.reshape(-1, decoded.channels)
+    x = x[:, 0] if decoded.channels == 1 else x.mean(axis=1)
+    return x.astype(np.float32) / np.float32(full_scale)
+
+def _stft_blocks(x, frame_size=1024, hop=256, block_frames=4096):
+    # Batched STFT: a strided view of hop-spaced frames (centred, so frame i sits at
+    # sample i * hop) and one windowing multiply + one rfft call per block of frames.
+    # Blocks keep the complex spectrogram of long files from being held all at once.
+    half = frame_size // 2
+    padded = np.pad(x, (half, half + frame_size))
+    frames = sliding_window_view(padded, frame_size)[::hop][:len(x) // hop + 1]
+    window = np.hanning(frame_size).astype(np.float32)
+    for start in range(0, len(frames), block_frames):
+        block = frames[start:start + block_frames] * window
+        yield np.abs(np.fft.rfft(block, axis=1)).astype(np.float32)
+
+def _spectral_flux(mag_blocks, compression=100.0):
+    # Log-compressed so quiet ghost notes still register; only rising energy counts
+    flux = []
+    prev = None
+    for mag in mag_blocks:
+        logmag = np.log1p(compression * mag)
+        if prev is None:
+            prev = logmag[:1]  # first frame has no predecessor: zero flux
+        flux.append(np.maximum(np.diff(np.concatenate((prev, logmag)), axis=0), 0.0).sum(axis=1))
+        prev = logmag[-1:]
+    return np.concatenate(flux) if flux else np.zeros(0, dtype=np.float32)
+
+def detect_peaks_flux(audio_file, threshold=0.2, min_distance=1000, frame_size=1024, hop=256):
+    return detect_peaks_flux_decoded(DecodedAudio.from_file(audio_file), threshold, min_distance,
+                                     frame_size, hop)
+
+def detect_peaks_flux_decoded(decoded, threshold=0.2, min_distance=1000, frame_size=1024, hop=256):
+    # Same (peaks, frame_rate) contract as detect_peaks: peaks are sample indices where
+    # the onset envelope crosses threshold * its maximum, min_distance samples apart
+    x = _mono_float(decoded)
+    if len(x) == 0:
+        return [], decoded.frame_rate
+    flux = _spectral_flux(_stft_blocks(x, frame_size, hop))
+    top = flux.max()
+    if top <= 0:
+        return [], decoded.frame_rate
+    crossings = np.flatnonzero(flux > threshold * top) * hop
+    crossings = crossings[crossings < len(x)]
+    return _pick_peaks(crossings, min_distance), decoded.frame_rate
+
+# ---------- Drum classification ----------
+def classify_peaks(audio_file, peaks, bands=DRUM_BANDS, frame_size=1024, hop=256):
+    return classify_peaks_decoded(DecodedAudio.from_file(audio_file), peaks, bands, frame_size, hop)
+
+def classify_peaks_decoded(decoded, peaks, bands=DRUM_BANDS, frame_size=1024, hop=256, block_peaks=1024):
+    # Labels each peak with the band whose energy rises most at the hit: a batched
+    # spectrogram of the frame at each peak and the frame one hop earlier, one rfft call per
+    # block of peaks, then per-band sums over the same bins. Cost scales with the hit count,
+    # not the track; blocks keep the gathered frames from growing with it too.
+    peaks = np.asarray(peaks, dtype=np.int64)
+    if len(peaks) == 0:
+        return []
+    x = _mono_float(decoded)
+    half = frame_size // 2
+    padded = np.pad(x, (half + hop, half))
+    frames = sliding_window_view(padded, frame_size)
+    centers = np.clip(peaks, 0, len(x) - 1) + hop
+    window = np.hanning(frame_size).astype(np.float32)
+
+    freqs = np.fft.rfftfreq(frame_size, 1.0 / decoded.frame_rate)
+    edges = [(np.searchsorted(freqs, lo), np.searchsorted(freqs, hi)) for _, lo, hi in bands]
+    scores = np.full((len(peaks), len(bands)), -np.inf)
+    for start in range(0, len(peaks), block_peaks):
+        c = centers[start:start + block_peaks]
+        batch = frames[np.stack((c - hop, c), axis=1)]  # (block, 2, frame_size)
+        power = np.abs(np.fft.rfft(batch * window, axis=-1)) ** 2
+        rise = np.maximum(power[:, 1] - power[:, 0], 0.0)
+        for j, (a, b) in enumerate(edges):
+            if b > a:
+                scores[start:start + len(c), j] = rise[:, a:b].sum(axis=1)
+    names = np.array([name for name, _, _ in bands])
+    return names[np.argmax(scores, axis=1)].tolist()
+
+def _filter_peaks(peaks, labels, classes):
+    # Keeps only the peaks whose label is in classes; no filter when either is None
+    if classes is None or labels is None:
+        return peaks
+    keep = np.isin(np.asarray(labels), list(classes))
+    return [p for p, k in zip(peaks, keep) if k]
+
+def detect_decoded(decoded, detector="amplitude"):
+    # The detector run_once uses, picked by the DETECTOR config value
+    if detector == "amplitude":
+        return detect_peaks_decoded(decoded, threshold=THRESHOLD, min_distance=MIN_DISTANCE)
+    if detector == "adaptive":
+        return detect_peaks_adaptive_decoded(decoded, ratio=ADAPTIVE_RATIO, min_distance=MIN_DISTANCE,
+                                             window_ms=ADAPTIVE_WINDOW_MS, floor=ADAPTIVE_FLOOR)
+    if detector == "flux":
+        return detect_peaks_flux_decoded(decoded, threshold=FLUX_THRESHOLD, min_distance=MIN_DISTANCE)
+    raise ValueError('DETECTOR must be "amplitude", "adaptive" or "flux"')
+
+# ---------- Streaming peak detection ----------
+WavInfo = namedtuple("WavInfo", "audio_format channels frame_rate bits data_offset data_size")
+
+def _read_wav_header(path):
+    # Walks the RIFF chunks up to "data"; returns None if this is not a RIFF/WAVE file
+    with open(path, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            return None
+        fmt = None
+        while True:
+            hdr = f.read(8)
+            if len(hdr) < 8:
+                return None
+            cid, size = hdr[:4], struct.unpack('<I', hdr[4:])[0]
+            if cid == b'fmt ':
+                body = f.read(size + (size & 1))
+                audio_format, channels, frame_rate = struct.unpack_from('<HHI', body)
+                bits = struct.unpack_from('<H', body, 14)[0]
+                if audio_format == 0xFFFE and size >= 40:
+                    audio_format = struct.unpack_from('<H', body, 24)[0]  # extensible: sub-format GUID
+                fmt = (audio_format, channels, frame_rate, bits)
+            elif cid == b'data':
+                if fmt is None:
+                    return None
+                offset = f.tell()
+                size = min(size, os.fstat(f.fileno()).st_size - offset)  # streamed exports may leave 0xFFFFFFFF
+                return WavInfo(*fmt, offset, size)
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+
+# One packed 24-bit sample as a record: the low 16 bits and the signed top byte
+_INT24 = [('lo', '<u2'), ('hi', 'i1')]
+
+def _unpack_int24(raw):
+    # (n, 3) little-endian bytes -> n sign-extended int32 values, via a record view of the bytes
+    packed = np.ascontiguousarray(raw).reshape(-1).view(_INT24)
+    samples = packed['hi'].astype(np.int32)
+    samples <<= 16
+    samples |= packed['lo']
+    return samples
+
+def _pack_int24(samples):
+    # int32 values in the 24-bit range (any shape, views included) -> (n, 3) little-endian bytes
+    packed = np.empty(np.shape(samples), dtype=_INT24)
+    np.copyto(packed['lo'], samples, casting='unsafe')  # keeps the low 16 bits
+    np.right_shift(samples, 16, out=packed['hi'], casting='unsafe')
+    return packed.reshape(-1).view(np.uint8).reshape(-1, 3)
+
+def _pcm_samples(raw, bits):
+    # Signed samples from the bytes of a PCM data chunk: unsigned 8-bit is re-biased the way
+    # pydub stores it, 16/32-bit are views of raw, 24-bit unpacks to int32
+    if bits == 8:
+        return (raw ^ 0x80).view(np.int8)
+    if bits == 24:
+        return _unpack_int24(raw.reshape(-1, 3))
+    return raw.view(f'<i{bits // 8}')
+
+def _read_wav_samples(path):
+    # (samples, frame_rate, sample_width, channels, floats) for the WAVs Audacity exports, without
+    # going through bytes/array.array: 16- and 32-bit PCM are read straight into an array with
+    # np.fromfile, 8-bit, 24-bit and float need one vectorised conversion pass. Nothing keeps
+    # the file open or mapped afterwards, so it can be deleted right away (Windows refuses
+    # while a mapping exists). None when pydub should decode the file instead.
+    info = _read_wav_header(path)
+    if info is None or info.channels == 0 or info.audio_format not in (1, 3):
+        return None
+    width = info.bits // 8
+    frames = info.data_size // (width * info.channels) if width else 0
+    if info.bits % 8 or frames == 0:
+        return None
+    count = frames * info.channels
+
+    if info.audio_format == 3:
+        if info.bits not in (32, 64):
+            return None
+        data = np.fromfile(path, dtype=f'<f{width}', count=count, offset=info.data_offset)
+        # float exports become full-scale 32-bit PCM, as ffmpeg hands them to pydub; the
+        # float data itself is passed on too
+        scaled = np.round(np.multiply(data, 2147483648.0, dtype=np.float64))
+        samples = np.clip(scaled, -2147483648.0, 2147483647.0, out=scaled).astype(np.int32)
+        return samples, info.frame_rate, 4, info.channels, data
+
+    if info.bits in (8, 16, 24, 32):
+        raw = np.fromfile(path, dtype=np.uint8, count=count * width, offset=info.data_offset)
+        return _pcm_samples(raw, info.bits), info.frame_rate, width, info.channels, None
+    return None
+
+def detect_peaks_streaming(wav_path, threshold=0.7, min_distance=1000, max_memory_mb=DETECT_MEMORY_MB):
+    # Same peaks as detect_peaks, but reads the data chunk in blocks of whole frames sized
+    # to stay under max_memory_mb, so RAM no longer scales with the file length. Each block
+    # goes through the same per-frame envelope as DecodedAudio, so peaks are frame indices.
+    info = _read_wav_header(wav_path)
+    if info is None or info.audio_format != 1 or info.bits not in (8, 16, 24, 32) or info.channels == 0:
+        return detect_peaks(wav_path, threshold=threshold, min_distance=min_distance)
+
+    width = info.bits // 8
+    frame_bytes = width * info.channels
+    frames = info.data_size // frame_bytes
+    if frames == 0:
+        return [], info.frame_rate
+    thr_value = threshold * ((2 ** (info.bits - 1)) - 1)
+
+    # per frame: the raw bytes, the decoded samples (24-bit unpacks to int32), the envelope,
+    # the mask and worst-case int64 crossing indices
+    per_frame = frame_bytes + (4 if info.bits == 24 else width) * (info.channels + 1) + 1 + 8
+    block = max(1, int(max_memory_mb * 1024 * 1024) // per_frame)
+
+    peaks = []
+    last_peak = None
+    with open(wav_path, 'rb') as f:
+        f.seek(info.data_offset)
+        for start in range(0, frames, block):
+            raw = np.fromfile(f, dtype=np.uint8, count=min(block, frames - start) * frame_bytes)
+            env = _frame_envelope(_pcm_samples(raw, info.bits), info.channels)
+            crossings = np.flatnonzero(np.abs(env) > thr_value) + start
+            found = _pick_peaks(crossings, min_distance, last_peak)
+            if found:
+                peaks.extend(found)
+                last_peak = found[-1]
+    return peaks, info.frame_rate
+
+# ---------- Direct WAV output ----------
+def _wav_header(data_size, frame_rate, sample_width, channels, audio_format=1):
+    # The 44-byte header the wave module (and so pydub's export) writes; audio_format 3
+    # marks IEEE float data
+    block_align = sample_width * channels
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, audio_format,
+                       channels, frame_rate, frame_rate * block_align, block_align,
+                       sample_width * 8, b'data', data_size)
+
+def _pcm_block(frames, sample_width, audio_format=1):
+    # One contiguous little-endian block in WAV byte order
+    if audio_format == 3:
+        return np.ascontiguousarray(frames, dtype=f'<f{sample_width}')
+    if sample_width == 1:
+        return np.ascontiguousarray(frames, dtype=np.int8).view(np.uint8) ^ 0x80  # WAV 8-bit is unsigned
+    if sample_width == 3:
+        return _pack_int24(frames)
+    return np.ascontiguousarray(frames, dtype=f'<i{sample_width}')
+
+class WavWriter:
+    # Streams blocks of samples into a WAV and patches the sizes into the header on close.
+    # Blocks hold interleaved samples or frames x channels; a mono source written with
+    # out_channels > 1 is spread through a broadcast view, so no full-length copy is made.
+    def __init__(self, path, frame_rate, sample_width, channels=1, out_channels=None, audio_format=1,
+                 block_frames=1 << 18):
+        self.out_channels = out_channels or channels
+        if self.out_channels != channels and channels != 1:
+            raise ValueError("WavWriter can only spread mono over several channels")
+        self.path = path
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.audio_format = audio_format
+        self.block_frames = block_frames
+        self.data_size = 0
+        self._file = open(path, 'wb')
+        self._file.write(self._header())
+
+    def _header(self):
+        return _wav_header(self.data_size, self.frame_rate, self.sample_width, self.out_channels,
+                           self.audio_format)
+
+    def write(self, block):
+        block = np.asarray(block).reshape(-1, self.channels)
+        for start in range(0, len(block), self.block_frames):
+            frames = block[start:start + self.block_frames]
+            if self.out_channels != self.channels:
+                frames = np.broadcast_to(frames, (len(frames), self.out_channels))
+            data = _pcm_block(frames, self.sample_width, self.audio_format)
+            self._file.write(data)
+            self.data_size += data.nbytes
+
+    def close(self):
+        if not self._file.closed:
+            self._file.seek(0)
+            self._file.write(self._header())
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_wav(path, samples, frame_rate, sample_width, channels=1, out_channels=None, block_frames=1 << 18,
+              audio_format=1):
+    # Writes one array, or an iterable of arrays, as a WAV file
+    blocks = [samples] if isinstance(samples, np.ndarray) else samples
+    with WavWriter(path, frame_rate, sample_width, channels, out_channels, audio_format, block_frames) as w:
+        for block in blocks:
+            w.write(block)
+    return path
 
 # ---------- Helpers ----------
-def _compute_windows_ms(peaks, frame_rate, window_ms, total_ms):
-    half = window_ms // 2
-    centers_ms = [int((p / frame_rate) * 1000) for p in peaks]
-    windows = []
-    for c in centers_ms:
-        s = max(0, c - half)
-        e = min(total_ms, c + half)
-        if e > s:
-            windows.append([s, e])
-    windows.sort(key=lambda w: w[0])
-    # merge overlaps
-    merged = []
-    for w in windows:
-        if not merged or w[0] > merged[-1][1]:
-            merged.append(w)
-        else:
-            merged[-1][1] = max(merged[-1][1], w[1])
-    return merged
+@contextlib.contextmanager
+def exchange_dir(base=None):
+    # A fresh private directory per job (mkdtemp is atomic, so concurrent runs never
+    # collide), on RAM-backed storage where available; removed even when the job fails
+    if base is None:
+        base = EXCHANGE_DIR or ("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+    path = tempfile.mkdtemp(prefix="toggle-", dir=base)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def _dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def _compute_windows(peaks, frame_rate, window_ms, total_samples):
+    # Windows centred on each peak, in samples: (starts, ends) arrays, sorted and merged.
+    # Overlapping or touching windows merge where a start does not exceed the running
+    # maximum of the ends before it (sort + cumulative max, no Python loop).
+    half = int(round(window_ms * frame_rate / 2000.0))
+    centers = np.asarray(peaks, dtype=np.int64)
+    starts = np.clip(centers - half, 0, total_samples)
+    ends = np.clip(centers + half, 0, total_samples)
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return starts, ends
+
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > reach[:-1]
+    heads = np.flatnonzero(new)
+    tails = np.append(heads[1:], len(starts)) - 1
+    return starts[heads], reach[tails]
 
 def _fit_to_length(seg, target_len_ms, frame_rate):
     if len(seg) == target_len_ms:
         return seg
     if len(seg) < target_len_ms:
+        from pydub import AudioSegment
         return seg + AudioSegment.silent(duration=target_len_ms - len(seg), frame_rate=frame_rate)
     return seg[:target_len_ms]
 
@@ -121,112 +880,550 @@ def _replace_segment_inplace(track, start_ms, end_ms, new_seg):
     return track[:start_ms] + fixed + track[end_ms:]
 
 # ---------- MODE: ISOLATE (drums only) ----------
-def render_isolated_drums(original_file, peaks, frame_rate, keep_duration_ms=60, fade_duration_ms=8):
-    audio = AudioSegment.from_file(original_file)
-    total_ms = len(audio)
-    windows = _compute_windows_ms(peaks, frame_rate, keep_duration_ms, total_ms)
-
-    out = AudioSegment.silent(duration=total_ms, frame_rate=audio.frame_rate)
-    for start, end in windows:
-        snippet = audio[start:end].fade_in(fade_duration_ms).fade_out(fade_duration_ms)
-        out = out.overlay(snippet, position=start)
-
-    path = os.path.join(os.getcwd(), "drums_only.wav")
-    out.set_channels(2).export(path, format="wav")
-    return path
+def _ragged_arange(starts, counts):
+    # concatenation of arange(s, s + c) for every (s, c) pair, without a Python loop:
+    # a run of +1 steps whose first element jumps to the next start
+    keep = counts > 0
+    starts, counts = np.asarray(starts)[keep], np.asarray(counts)[keep]
+    if len(counts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    steps = np.ones(int(counts.sum()), dtype=np.int64)
+    steps[0] = starts[0]
+    heads = np.cumsum(counts[:-1])
+    steps[heads] = starts[1:] - (starts[:-1] + counts[:-1] - 1)
+    return np.cumsum(steps, out=steps)
+
+def _isolate_envelope(starts, ends, total_frames, frame_rate, fade_duration_ms, fade_floor_db=-120):
+    # Per-frame keep gain: 1.0 inside the windows, 0.0 elsewhere, with pydub-style fades
+    # (one gain step per frame up from / down to -120 dB) at both ends of every window.
+    gain = np.zeros(total_frames, dtype=np.float64)
+    gain[_ragged_arange(starts, ends - starts)] = 1.0
+
+    fade_frames = fade_duration_ms * frame_rate / 1000.0
+    n = int(fade_frames)
+    if n <= 0 or len(starts) == 0:
+        return gain
+
+    floor_power = 10 ** (fade_floor_db / 20.0)
+    counts = np.minimum(ends - starts, n)
+    k = _ragged_arange(np.zeros(len(counts), dtype=np.int64), counts)
+    gain[_ragged_arange(starts, counts)] = floor_power + ((1.0 - floor_power) / fade_frames) * k
+    gain[_ragged_arange(ends - counts, counts)] *= 1.0 + ((floor_power - 1.0) / fade_frames) * k
+    return gain
+
+def render_isolated_drums(original_file, peaks, frame_rate, keep_duration_ms=60, fade_duration_ms=8,
+                          labels=None, classes=None, out_path=None, float_output=False):
+    return render_isolated_drums_decoded(DecodedAudio.from_file(original_file), peaks, frame_rate,
+                                         keep_duration_ms, fade_duration_ms, labels, classes, out_path,
+                                         float_output)
+
+def render_isolated_drums_decoded(decoded, peaks, frame_rate, keep_duration_ms=60, fade_duration_ms=8,
+                                  labels=None, classes=None, out_path=None, float_output=False):
+    peaks = _filter_peaks(peaks, labels, classes)
+    samples = decoded.samples.reshape(-1, decoded.channels)
+    starts, ends = _compute_windows(peaks, frame_rate, keep_duration_ms, len(samples))
+    gain = _isolate_envelope(starts, ends, len(samples), decoded.frame_rate, fade_duration_ms)
+    path = out_path or os.path.join(os.getcwd(), "drums_only.wav")
+    out_channels = 2 if decoded.channels == 1 else decoded.channels
+
+    if float_output:
+        frames = decoded.frames_float32()
+        frames *= gain.astype(np.float32)[:, None]
+        return write_wav(path, frames, decoded.frame_rate, 4, decoded.channels, out_channels, audio_format=3)
+
+    # floor() matches audioop.mul, which pydub uses for its fades
+    samples = np.floor(samples * gain[:, None]).astype(samples.dtype)
+
+    sample_width = decoded.sample_width
+    if sample_width < 2:
+        # overlaying onto pydub's 16-bit silence widened 8-bit input
+        samples, sample_width = samples.astype(np.int16) << 8, 2
+    return write_wav(path, samples, decoded.frame_rate, sample_width, decoded.channels, out_channels)
 
 # ---------- MODE: SILENCE (sample-accurate pre/post fades) ----------
+def _ragged_linspace(start, stop, counts):
+    # concatenation of np.linspace(start, stop, c) for every count, bit-identical to it
+    counts = np.maximum(counts, 0)
+    k = _ragged_arange(np.zeros(len(counts), dtype=np.int64), counts)
+    n = np.repeat(counts, counts)
+    y = k * np.repeat((stop - start) / np.maximum(counts - 1, 1), counts) + start
+    y[(k == n - 1) & (n > 1)] = stop
+    return y
+
+def _silence_envelope(starts, ends, total_samples, pre_n, post_n, window_gain, dtype="float32"):
+    # Gain for every sample: window_gain inside [starts, ends), a linspace(1, 0) pre-fade
+    # and linspace(0, 1) post-fade around each window, 1.0 elsewhere. Fades stop at the
+    # neighbouring window. Where a post-fade runs into the next pre-fade the old loop
+    # rounded twice, so those samples are also returned with both factors separately.
+    gain = np.ones(total_samples, dtype=dtype)
+    overlap = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+    if len(starts) == 0:
+        return gain, overlap
+
+    # Only the windows and their fades are touched; the rest stays at unity
+    gain[_ragged_arange(starts, ends - starts)] = window_gain
+
+    prev_ends = np.concatenate(([0], ends[:-1]))
+    next_starts = np.concatenate((starts[1:], [total_samples]))
+
+    # Pre-fade: linspace(1, 0, n) ending just before each window
+    fade_starts = np.clip(starts - pre_n, prev_ends, starts)
+    pre_idx = _ragged_arange(fade_starts, starts - fade_starts)
+    pre_gain = _ragged_linspace(1.0, 0.0, starts - fade_starts)
+
+    # Post-fade: linspace(0, 1, n) starting at each window end
+    fade_ends = np.clip(ends + post_n, ends, next_starts)
+    post_idx = _ragged_arange(ends, fade_ends - ends)
+    post_gain = _ragged_linspace(0.0, 1.0, fade_ends - ends)
+
+    gain[pre_idx] *= pre_gain
+    gain[post_idx] *= post_gain
+
+    # Window i's post-fade can only meet window i+1's pre-fade, inside the gap between them
+    lo = np.maximum(ends[:-1], fade_starts[1:])
+    hi = np.minimum(fade_ends[:-1], starts[1:])
+    pre_base = np.cumsum(starts - fade_starts) - (starts - fade_starts)
+    post_base = np.cumsum(fade_ends - ends) - (fade_ends - ends)
+    idx = _ragged_arange(lo, hi - lo)
+    n = np.maximum(hi - lo, 0)
+    at_post = idx + np.repeat(post_base[:-1] - ends[:-1], n)
+    at_pre = idx + np.repeat(pre_base[1:] - fade_starts[1:], n)
+    return gain, (idx, post_gain[at_post], pre_gain[at_pre])
+
 def render_silenced_drums_sample_accurate(original_file, peaks, frame_rate,
                                           silence_window_ms=60, pre_fade_ms=20, post_fade_ms=20,
-                                          silence_full=True, attenuation_db=30):
-    audio = AudioSegment.from_file(original_file)
-    if audio.channels > 1:
-        audio = audio.set_channels(1)
+                                          silence_full=True, attenuation_db=30,
+                                          labels=None, classes=None, out_path=None, float_output=False):
+    return render_silenced_drums_decoded(DecodedAudio.from_file(original_file), peaks, frame_rate,
+                                         silence_window_ms, pre_fade_ms, post_fade_ms,
+                                         silence_full, attenuation_db, labels, classes, out_path,
+                                         float_output)
 
-    sr = audio.frame_rate
-    sw = audio.sample_width
-    dtype = {1: np.int8, 2: np.int16, 3: np.int32, 4: np.int32}.get(sw, np.int16)
+def render_silenced_drums_decoded(decoded, peaks, frame_rate,
+                                  silence_window_ms=60, pre_fade_ms=20, post_fade_ms=20,
+                                  silence_full=True, attenuation_db=30,
+                                  labels=None, classes=None, out_path=None, float_output=False):
+    peaks = _filter_peaks(peaks, labels, classes)
 
-    samples = np.array(audio.get_array_of_samples()).astype(np.int64)
-    total_samples = len(samples)
-    total_ms = len(audio)
-    windows_ms = _compute_windows_ms(peaks, frame_rate, silence_window_ms, total_ms)
+    sr = decoded.frame_rate
+    sw = decoded.sample_width
+    dtype = {1: np.int8, 2: np.int16, 3: np.int32, 4: np.int32}.get(sw, np.int16)
+    x = decoded.samples.reshape(-1, decoded.channels)
+    total_samples = len(x)
+    starts, ends = _compute_windows(peaks, frame_rate, silence_window_ms, total_samples)
 
     spms = sr / 1000.0
     pre_n  = int(round(pre_fade_ms * spms))
     post_n = int(round(post_fade_ms * spms))
 
-    def clamp(a, lo, hi): return max(lo, min(hi, a))
-
-    for i, (start_ms, end_ms) in enumerate(windows_ms):
-        start_s = clamp(int(round(start_ms * spms)), 0, total_samples)
-        end_s   = clamp(int(round(end_ms * spms)),   0, total_samples)
-        prev_end_s   = clamp(int(round(windows_ms[i-1][1] * spms)), 0, total_samples) if i > 0 else 0
-        next_start_s = clamp(int(round(windows_ms[i+1][0] * spms)), 0, total_samples) if i + 1 < len(windows_ms) else total_samples
-
-        # Pre-fade to 0
-        ps = clamp(start_s - pre_n, prev_end_s, start_s)
-        n = start_s - ps
-        if n > 0:
-            seg = samples[ps:start_s].astype(np.float64)
-            ramp = np.linspace(1.0, 0.0, n, endpoint=True)
-            samples[ps:start_s] = np.round(seg * ramp).astype(np.int64)
-
-        # Silence/attenuate window
-        if end_s > start_s:
-            if silence_full:
-                samples[start_s:end_s] = 0
-            else:
-                gain = 10.0 ** (-attenuation_db / 20.0)
-                seg = samples[start_s:end_s].astype(np.float64) * gain
-                samples[start_s:end_s] = np.round(seg).astype(np.int64)
-
-        # Post-fade from 0
-        pe = clamp(end_s + post_n, end_s, next_start_s)
-        n = pe - end_s
-        if n > 0:
-            seg = samples[end_s:pe].astype(np.float64)
-            ramp = np.linspace(0.0, 1.0, n, endpoint=True)
-            samples[end_s:pe] = np.round(seg * ramp).astype(np.int64)
-
-    # Clip and rebuild
-    if dtype == np.int8:
-        samples = np.clip(samples, -128, 127).astype(np.int8)
-    elif dtype == np.int16:
-        samples = np.clip(samples, -32768, 32767).astype(np.int16)
-    else:
-        samples = np.clip(samples, -2147483648, 2147483647).astype(np.int32)
+    window_gain = 0.0 if silence_full else 10.0 ** (-attenuation_db / 20.0)
+    path = out_path or os.path.join(os.getcwd(), "drums_silenced.wav")
+    out_channels = 2 if decoded.channels == 1 else decoded.channels
+
+    if float_output:
+        # Nothing is rounded, so the overlapping fades need no special care: one multiply
+        gain, _ = _silence_envelope(starts, ends, total_samples, pre_n, post_n, window_gain, np.float32)
+        frames = decoded.frames_float32()
+        frames *= gain[:, None]
+        return write_wav(path, frames, sr, 4, decoded.channels, out_channels, audio_format=3)
+
+    # float32 is exact enough for up to 16-bit samples; 32-bit needs double-precision ramps
+    gain_dtype = np.float32 if sw <= 2 else np.float64
+    gain, (idx, g_post, g_pre) = _silence_envelope(starts, ends, total_samples, pre_n, post_n,
+                                                   window_gain, gain_dtype)
+
+    # One multiply, one round, one clip for the whole track; the gain is per frame and
+    # broadcast across the channels. 24-bit samples live in int32 but clip to 24 bits.
+    lo, hi = -(2 ** (8 * sw - 1)), 2 ** (8 * sw - 1) - 1
+    samples = np.round(x * gain[:, None])
+    samples[idx] = np.round(np.round(x[idx] * g_post[:, None]) * g_pre[:, None])
+    samples = np.clip(samples, lo, hi, out=samples).astype(dtype)
+    return write_wav(path, samples, sr, sw, decoded.channels, out_channels)
+
+# ---------- MODE: SILENCE inside Audacity (region edits) ----------
+def _silence_commands(starts, ends, total_samples, frame_rate, pre_n, post_n, window_effect, offset=0.0):
+    # SelectTime + effect for every merged window and its fades, clipped to the neighbours
+    # the same way _silence_envelope clips them; offset is the project time of sample 0
+    prev_ends = np.concatenate(([0], ends[:-1]))
+    next_starts = np.concatenate((starts[1:], [total_samples]))
+    fade_starts = np.clip(starts - pre_n, prev_ends, starts)
+    fade_ends = np.clip(ends + post_n, ends, next_starts)
+
+    def region(a, b, effect):
+        return (f"SelectTime: Start={offset + a / frame_rate:.6f} End={offset + b / frame_rate:.6f} "
+                "RelativeTo=ProjectStart",
+                effect)
+
+    commands = ["SelectAll:"]
+    for fs, s, e, fe in zip(fade_starts.tolist(), starts.tolist(), ends.tolist(), fade_ends.tolist()):
+        if s > fs:
+            commands.extend(region(fs, s, "FadeOut:"))
+        commands.extend(region(s, e, window_effect))
+        if fe > e:
+            commands.extend(region(e, fe, "FadeIn:"))
+    return commands
+
+def silence_drums_in_audacity(decoded, peaks, frame_rate,
+                              silence_window_ms=60, pre_fade_ms=20, post_fade_ms=20,
+                              silence_full=True, attenuation_db=30,
+                              labels=None, classes=None, offset=0.0):
+    # Same windows and fades as render_silenced_drums_decoded, applied to the open project
+    # with pipelined commands; only the touched regions change and nothing is re-imported.
+    # offset is where the export started in project time (see _export_project)
+    peaks = _filter_peaks(peaks, labels, classes)
+    total_samples = len(decoded.samples) // decoded.channels
+    starts, ends = _compute_windows(peaks, frame_rate, silence_window_ms, total_samples)
+
+    spms = frame_rate / 1000.0
+    pre_n = int(round(pre_fade_ms * spms))
+    post_n = int(round(post_fade_ms * spms))
+    window_effect = "Silence:" if silence_full else f"Amplify: Ratio={10.0 ** (-attenuation_db / 20.0):.6f}"
 
-    processed = AudioSegment(data=samples.tobytes(), sample_width=sw, frame_rate=sr, channels=1)
-    path = os.path.join(os.getcwd(), "drums_silenced.wav")
-    processed.set_channels(2).export(path, format="wav")
+    commands = _silence_commands(starts, ends, total_samples, frame_rate, pre_n, post_n, window_effect,
+                                 offset)
+    failed = [r for r in do_commands(commands) if "BatchCommand finished: OK" not in r]
+    print(f"Edited {len(starts)} regions in place with {len(commands)} commands"
+          + (f", {len(failed)} failed" if failed else ""))
+    return len(commands)
+
+# ---------- MODE: LABELS (hits as an Audacity label track) ----------
+def write_label_file(path, peaks, frame_rate, window_ms=60, labels=None, offset=0.0):
+    # One region label per hit spanning its window, in Audacity's "start<TAB>end<TAB>text" format;
+    # the text is the drum class when labels are given. offset is the project time of sample 0.
+    peaks = np.asarray(peaks, dtype=np.int64)
+    half = window_ms / 2000.0
+    times = peaks / float(frame_rate) + offset
+    starts = np.maximum(times - half, offset).tolist()
+    ends = (times + half).tolist()
+    names = labels if labels is not None else ["hit"] * len(starts)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join([f"{a:.6f}\t{b:.6f}\t{n}\n" for a, b, n in zip(starts, ends, names)]))
     return path
 
+# ---------- MODE: SPLIT (clips split at every hit) ----------
+def _split_commands(peaks, frame_rate, offset=0.0):
+    commands = []
+    for t in (np.asarray(peaks, dtype=np.int64) / float(frame_rate) + offset).tolist():
+        commands.append(f"SelectTime: Start={t:.6f} End={t:.6f} RelativeTo=ProjectStart")
+        commands.append("Split:")
+    return commands
+
+def split_at_peaks(peaks, frame_rate, batch_size=2000, labels=None, classes=None, offset=0.0):
+    # SelectTime + Split for every hit, pipelined in batches over one connection; offset is
+    # the project time of sample 0
+    peaks = _filter_peaks(peaks, labels, classes)
+    commands = ["SelectAll:"] + _split_commands(peaks, frame_rate, offset)
+    step = 2 * batch_size
+
+    async def run():
+        failed = 0
+        async with AsyncPipeClient() as client:
+            for i in range(0, len(commands), step):
+                replies = await client.send_many(commands[i:i + step])
+                failed += sum("BatchCommand finished: OK" not in r for r in replies)
+                print(f"Split {(min(i + step, len(commands)) - 1) // 2}/{len(peaks)} hits")
+        return failed
+
+    t0 = time.perf_counter()
+    failed = asyncio.run(run())
+    print(f"Split at {len(peaks)} hits in {time.perf_counter() - t0:.2f} s"
+          + (f", {failed} commands failed" if failed else ""))
+    return len(peaks)
+
+# ---------- MODE: TOGGLE (drums + residual stems, rendered once) ----------
+def render_stems_decoded(decoded, peaks, frame_rate, keep_duration_ms=60, fade_duration_ms=8,
+                         labels=None, classes=None, out_dir=None, float_output=False, block_frames=1 << 18,
+                         prefix=""):
+    # One gain envelope, one pass over the audio, two files: drums = x * g and the residual
+    # x * (1 - g), computed as x - drums so the two stems always sum back to the input exactly
+    peaks = _filter_peaks(peaks, labels, classes)
+    out_dir = out_dir or os.getcwd()
+    samples = decoded.samples.reshape(-1, decoded.channels)
+    starts, ends = _compute_windows(peaks, frame_rate, keep_duration_ms, len(samples))
+    gain = _isolate_envelope(starts, ends, len(samples), decoded.frame_rate, fade_duration_ms)
+
+    sample_width, audio_format = (4, 3) if float_output else (decoded.sample_width, 1)
+    if float_output:
+        gain = gain.astype(np.float32)
+    out_channels = 2 if decoded.channels == 1 else decoded.channels
+    paths = (os.path.join(out_dir, f"{prefix}drums.wav"), os.path.join(out_dir, f"{prefix}residual.wav"))
+    with WavWriter(paths[0], decoded.frame_rate, sample_width, decoded.channels, out_channels, audio_format) as drums_out, \
+            WavWriter(paths[1], decoded.frame_rate, sample_width, decoded.channels, out_channels, audio_format) as rest_out:
+        for start in range(0, len(samples), block_frames):
+            x = samples[start:start + block_frames]
+            g = gain[start:start + block_frames, None]
+            if float_output:
+                x = decoded.frames_float32(start, start + block_frames)
+                drums = x * g
+            else:
+                drums = np.floor(x * g).astype(x.dtype)  # floor() like the isolate render
+            drums_out.write(drums)
+            rest_out.write(x - drums)
+    return paths
+
+class ToggleSession:
+    # Drums and residual stems of the current project, kept in a per-user directory under
+    # EXCHANGE_DIR across runs. Every toggle() removes the stem it imported last time and
+    # imports the other one; only the first one after the project (or the detection
+    # settings) changed does any DSP. "Changed" is judged from GetInfo's track names,
+    # bounds and channels, so edits that keep those (an effect applied in Audacity, say) go
+    # unnoticed: set TOGGLE_RERENDER for one run after such an edit. This script's own
+    # in-place silence mode invalidates the session itself.
+    # Audacity names an imported track after its file, so the stems get a prefix no one
+    # would give a track, and session.json records which tracks the session imported: only
+    # those are left out of the export and the key, never a user's own "drums" track.
+    STEMS = ("drums", "residual")
+    PREFIX = "toggle-"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.state_path = os.path.join(directory, "session.json")
+
+    @classmethod
+    def open(cls, base=None):
+        if base is None:
+            base = EXCHANGE_DIR or ("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+        directory = os.path.join(base, f"toggle-session-{getpass.getuser()}")
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # The name is predictable and base may be world-writable (/dev/shm): only use a
+        # real directory that this user owns and nobody else can reach
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode) or (hasattr(os, "getuid") and
+                                              (info.st_uid != os.getuid() or info.st_mode & 0o077)):
+            raise PermissionError(f"{directory} must be a directory owned by you with mode 0700")
+        return cls(directory)
+
+    def _key(self, imported):
+        # The project's wave tracks (minus the stems imported by earlier toggles) and every
+        # setting the stems depend on. Only fields that describe the audio count: GetInfo
+        # also reports selection, focus, gain, pan, solo, mute and zoom, and Import2 itself
+        # changes the selection and focus.
+        tracks = [[t.get(field) for field in ("name", "kind", "start", "end", "channels")]
+                  for t in _get_tracks() if t.get("kind", "wave") == "wave" and t.get("name") not in imported]
+        settings = (DETECTOR, THRESHOLD, MIN_DISTANCE, ADAPTIVE_RATIO, ADAPTIVE_WINDOW_MS, ADAPTIVE_FLOOR,
+                    FLUX_THRESHOLD, DRUM_CLASSES, DRUM_BANDS, WINDOW_MS, EXPORT_CHANNELS, FLOAT_OUTPUT)
+        return hashlib.sha1(json.dumps([tracks, repr(settings)], sort_keys=True).encode()).hexdigest()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _render(self, imported):
+        # The export is only needed for this run, so it goes through its own exchange directory
+        with exchange_dir() as job:
+            temp_wav = os.path.join(job, "export.wav")
+            _export_project(temp_wav, EXPORT_CHANNELS, exclude=imported)  # never the stems themselves
+            decoded = DecodedAudio.from_file(temp_wav)
+            peaks, frame_rate, labels = _detect_and_classify(decoded)
+            render_stems_decoded(decoded, peaks, frame_rate, keep_duration_ms=WINDOW_MS, fade_duration_ms=8,
+                                 labels=labels, classes=DRUM_CLASSES, out_dir=self.directory,
+                                 float_output=FLOAT_OUTPUT, prefix=self.PREFIX)
+
+    def _remove_stems(self, imported):
+        # Removes the tracks earlier toggles imported (the last one of each name, as Import2
+        # appends), highest index first so the others keep their positions
+        tracks = _get_tracks()
+        found = {}
+        for i, t in enumerate(tracks):
+            if t.get("name") in imported:
+                found[t["name"]] = i
+        for i in sorted(found.values(), reverse=True):
+            do_command(f"SelectTracks: Track={i} TrackCount=1 Mode=Set")
+            do_command("RemoveTracks:")
+
+    def invalidate(self):
+        # Forces the next toggle() to render again, e.g. after the audio was edited in place
+        state = self._load_state()
+        if state.pop("key", None) is not None:
+            with open(self.state_path, "w") as f:
+                json.dump(state, f)
+
+    def toggle(self):
+        state = self._load_state()
+        imported = state.get("imported", [])
+        key = self._key(imported)
+        stems = {name: os.path.join(self.directory, f"{self.PREFIX}{name}.wav") for name in self.STEMS}
+        if TOGGLE_RERENDER or state.get("key") != key or not all(os.path.exists(p) for p in stems.values()):
+            t0 = time.perf_counter()
+            self._render(imported)
+            state = {"key": key, "next": self.STEMS[0], "imported": imported}
+            print(f"[TOGGLE] Rendered drums and residual in {time.perf_counter() - t0:.2f} s")
+        name = state["next"]
+        self._remove_stems(imported)
+        do_command(f'Import2: Filename="{stems[name]}"')
+        state["imported"] = [self.PREFIX + name]  # the track name Import2 gives it
+        state["next"] = self.STEMS[1] if name == self.STEMS[0] else self.STEMS[0]
+        with open(self.state_path, "w") as f:
+            json.dump(state, f)
+        print(f"[TOGGLE] Imported {name} from {self.directory}")
+        return name
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
 # ---------- One-button runner ----------
-def run_once(mode):
-    temp_wav = tempfile.mktemp(suffix=".wav")
-    print(f"[{mode.upper()}] Temporary WAV file location: {temp_wav}")
-    do_command(f'Export2: Filename="{temp_wav}" NumChannels=1')
+def _get_tracks():
+    # Every track of the open project as GetInfo describes it (name, kind, start, end, ...)
+    reply = do_command("GetInfo: Type=Tracks Format=JSON")
+    return json.loads(reply[:reply.rindex("]") + 1])
+
+def _project_start(tracks=None):
+    # Where SelectAll: starts the selection, and so where Export2's file starts
+    return min((t.get("start", 0.0) for t in (tracks or _get_tracks())), default=0.0)
 
-    peaks, frame_rate = detect_peaks(temp_wav, threshold=THRESHOLD, min_distance=MIN_DISTANCE)
+def _export_project(path, channels=None, exclude=()):
+    # Exports the whole project and returns the project time of the file's first sample.
+    # Export2 writes the selection, so everything is selected first; if any track is named in
+    # exclude, only the other wave tracks, over their own time span. channels=None keeps the widest
+    # exported wave track's channel count, as GetInfo reports it.
+    tracks = _get_tracks()
+    waves = [(i, t) for i, t in enumerate(tracks) if t.get("kind", "wave") == "wave"]
+    kept = [(i, t) for i, t in waves if t.get("name") not in exclude]
+    if len(kept) < len(waves):
+        waves = kept
+        if not waves:
+            raise ValueError("no wave tracks left to export")
+        start = _project_start([t for _, t in waves])
+        end = max(t.get("end", 0.0) for _, t in waves)
+        do_command(f"SelectTime: Start={start:.6f} End={end:.6f} RelativeTo=ProjectStart")
+        for n, (i, _) in enumerate(waves):
+            do_command(f"SelectTracks: Track={i} TrackCount=1 Mode={'Add' if n else 'Set'}")
+    else:
+        start = _project_start(tracks)
+        do_command("SelectAll:")
+    if channels is None:
+        channels = max((t.get("channels", 1) for _, t in waves), default=1)
+    do_command(f'Export2: Filename="{path}" NumChannels={channels}')
+    return start
+
+def _detect_and_classify(decoded):
+    peaks, frame_rate = detect_decoded(decoded, DETECTOR)
     print(f"Detected peaks: {len(peaks)}")
 
+    labels = None
+    if DRUM_CLASSES is not None:
+        labels = classify_peaks_decoded(decoded, peaks)
+        counts = {name: labels.count(name) for name, _, _ in DRUM_BANDS}
+        print(f"Hits per class: {counts}, keeping {', '.join(DRUM_CLASSES)}")
+    return peaks, frame_rate, labels
+
+def _render_for_import(decoded, mode, peaks, frame_rate, labels, out_dir, prefix="", offset=0.0):
+    # The file Import2 brings back for the modes that produce one; offset places label times
+    if mode == "labels":
+        peaks, labels = _filter_peaks(peaks, labels, DRUM_CLASSES), _filter_peaks(labels, labels, DRUM_CLASSES)
+        return write_label_file(os.path.join(out_dir, f"{prefix}hits.txt"), peaks, frame_rate, WINDOW_MS, labels,
+                                offset)
     if mode == "isolate":
-        out = render_isolated_drums(temp_wav, peaks, frame_rate, keep_duration_ms=WINDOW_MS, fade_duration_ms=8)
-    elif mode == "silence":
-        out = render_silenced_drums_sample_accurate(temp_wav, peaks, frame_rate,
-                                                    silence_window_ms=WINDOW_MS,
-                                                    pre_fade_ms=PRE_FADE_MS,
-                                                    post_fade_ms=POST_FADE_MS,
-                                                    silence_full=True, attenuation_db=30)
-    else:
-        raise ValueError('MODE must be "isolate" or "silence"')
+        return render_isolated_drums_decoded(decoded, peaks, frame_rate, keep_duration_ms=WINDOW_MS,
+                                             fade_duration_ms=8, labels=labels, classes=DRUM_CLASSES,
+                                             out_path=os.path.join(out_dir, f"{prefix}drums_only.wav"),
+                                             float_output=FLOAT_OUTPUT)
+    return render_silenced_drums_decoded(decoded, peaks, frame_rate,
+                                         silence_window_ms=WINDOW_MS,
+                                         pre_fade_ms=PRE_FADE_MS,
+                                         post_fade_ms=POST_FADE_MS,
+                                         silence_full=True, attenuation_db=30,
+                                         labels=labels, classes=DRUM_CLASSES,
+                                         out_path=os.path.join(out_dir, f"{prefix}drums_silenced.wav"),
+                                         float_output=FLOAT_OUTPUT)
+
+def run_once(mode):
+    if mode not in ("isolate", "silence", "labels", "split", "toggle"):
+        raise ValueError('MODE must be "isolate", "silence", "labels", "split" or "toggle"')
+    if mode == "toggle":
+        return ToggleSession.open().toggle()
+    if ALL_TRACKS:
+        return run_tracks(mode)
+
+    with exchange_dir() as job:
+        temp_wav = os.path.join(job, "export.wav")
+        print(f"[{mode.upper()}] Temporary WAV file location: {temp_wav}")
+        offset = _export_project(temp_wav, EXPORT_CHANNELS)
+
+        if mode == "split" and DETECTOR == "amplitude" and DRUM_CLASSES is None:
+            # only the hit positions are needed, so the export is streamed instead of decoded
+            peaks, frame_rate = detect_peaks_streaming(temp_wav, THRESHOLD, MIN_DISTANCE)
+            print(f"Detected peaks: {len(peaks)}")
+            decoded = labels = None
+        else:
+            decoded = DecodedAudio.from_file(temp_wav)
+            peaks, frame_rate, labels = _detect_and_classify(decoded)
+
+        if mode == "silence" and EDIT_IN_PLACE:
+            silence_drums_in_audacity(decoded, peaks, frame_rate,
+                                      silence_window_ms=WINDOW_MS,
+                                      pre_fade_ms=PRE_FADE_MS,
+                                      post_fade_ms=POST_FADE_MS,
+                                      silence_full=True, attenuation_db=30,
+                                      labels=labels, classes=DRUM_CLASSES, offset=offset)
+            ToggleSession.open().invalidate()  # its stems were rendered from the unedited audio
+        elif mode == "split":
+            split_at_peaks(peaks, frame_rate, batch_size=SPLIT_BATCH, labels=labels, classes=DRUM_CLASSES,
+                           offset=offset)
+        else:
+            out = _render_for_import(decoded, mode, peaks, frame_rate, labels, job, offset=offset)
+            do_command(f'Import2: Filename="{out}"')
+            if mode == "labels":
+                print(f"Imported {len(_filter_peaks(peaks, labels, DRUM_CLASSES))} labels")
+
+        moved = _dir_bytes(job)
+    print(f"[{mode.upper()}] Exchange directory {job} deleted, {moved / 1e6:.1f} MB moved through it.")
+
+# ---------- Multi-track projects ----------
+def list_tracks():
+    # Wave tracks of the open project as (index, name, channels); the index counts every track
+    tracks = _get_tracks()
+    return [(i, t.get("name", f"Track {i + 1}"), t.get("channels", 1))
+            for i, t in enumerate(tracks) if t.get("kind", "wave") == "wave"]
+
+def _export_track(index, path, channels=1):
+    do_command(f"SelectTracks: Track={index} TrackCount=1 Mode=Set")
+    do_command(f'Export2: Filename="{path}" NumChannels={EXPORT_CHANNELS or channels}')
+    return path
 
-    do_command(f'Import2: Filename="{out}"')
+def _process_track(wav_path, mode, out_dir, prefix, offset=0.0):
+    # Runs in a DSP worker process: decode, detect and render one exported track
+    decoded = DecodedAudio.from_file(wav_path)
+    peaks, frame_rate, labels = _detect_and_classify(decoded)
+    return _render_for_import(decoded, mode, peaks, frame_rate, labels, out_dir, prefix, offset), len(peaks)
 
-    os.remove(temp_wav)
-    os.remove(out)
-    print(f"[{mode.upper()}] Temporary files {temp_wav} and {out} deleted.")
+def run_tracks(mode, max_workers=None):
+    # Exports and imports go through one I/O thread, in order, since the pipe takes one
+    # command at a time; every track is handed to the process pool as soon as its export
+    # lands, so Audacity exports the next track while earlier ones are being processed.
+    # Workers are spawned, not forked: the I/O and pipe reader threads are already running
+    # when the pool starts, and a forked child could inherit one of their locks held.
+    # They re-import this file, so they see the CONFIG values written in it.
+    if mode == "split" or (mode == "silence" and EDIT_IN_PLACE):
+        raise ValueError('ALL_TRACKS supports "isolate", "silence" and "labels" renders only')
+    t0 = time.perf_counter()
+    with exchange_dir() as job, ThreadPoolExecutor(max_workers=1) as io, \
+            ProcessPoolExecutor(max_workers=max_workers or DSP_WORKERS,
+                                mp_context=multiprocessing.get_context("spawn")) as dsp:
+        tracks = list_tracks()
+        offset = _project_start()  # every export spans the SelectAll: time selection
+        print(f"[{mode.upper()}] {len(tracks)} wave tracks, exchanging files in {job}")
+        do_command("SelectAll:")
+        exports = [io.submit(_export_track, index, os.path.join(job, f"track{index}.wav"), channels)
+                   for index, _, channels in tracks]
+        renders = []
+        for (index, name, _), export in zip(tracks, exports):
+            # the index keeps names that sanitize alike ("Kick 1", "Kick_1") apart
+            prefix = f"{index}-" + "".join(c if c.isalnum() or c in "-_" else "_" for c in name) + "-"
+            renders.append(dsp.submit(_process_track, export.result(), mode, job, prefix, offset))
+        imports = []
+        for (index, name, _), render in zip(tracks, renders):
+            out, n_peaks = render.result()
+            print(f"Track {index} ({name}): {n_peaks} peaks")
+            imports.append(io.submit(do_command, f'Import2: Filename="{out}"'))
+        for imported in imports:
+            imported.result()
+        moved = _dir_bytes(job)
+    print(f"[{mode.upper()}] {len(tracks)} tracks in {time.perf_counter() - t0:.2f} s, "
+          f"{moved / 1e6:.1f} MB moved through {job}.")
 
 # ---------- Run ----------
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+# Peak picking on dense material: per-crossing Python loop vs Toggle._pick_peaks.
+# Run from the repo root: python benchmarks/bench_peaks.py
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Toggle import _pick_peaks
+
+SECONDS = 600      # ten-minute stem
+FRAME_RATE = 44100
+THRESHOLD = 0.7
+MIN_DISTANCE = 1000
+
+def loop_pick(threshold_peaks, min_distance):
+    # the original detect_peaks loop
+    peaks = []
+    last_peak = -min_distance
+    for p in threshold_peaks:
+        if p - last_peak > min_distance:
+            peaks.append(p)
+            last_peak = p
+    return peaks
+
+def dense_master(seconds, frame_rate, seed=0):
+    # heavily limited noise: a large share of samples sit above the threshold
+    rng = np.random.default_rng(seed)
+    x = np.tanh(rng.normal(0.0, 1.5, seconds * frame_rate))
+    return (x * 32767).astype(np.int16)
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - t0
+
+if __name__ == "__main__":
+    samples = np.abs(dense_master(SECONDS, FRAME_RATE).astype(np.int32))
+    crossings = np.flatnonzero(samples > THRESHOLD * 32767)
+    print(f"{SECONDS}s @ {FRAME_RATE} Hz, {len(crossings)} crossings above {THRESHOLD}")
+
+    ref, t_loop = timed(loop_pick, crossings, MIN_DISTANCE)
+    new, t_vec = timed(_pick_peaks, crossings, MIN_DISTANCE)
+    assert [int(p) for p in ref] == [int(p) for p in new], "peak lists differ"
+
+    print(f"python loop : {t_loop:8.3f} s  ({len(ref)} peaks)")
+    print(f"_pick_peaks : {t_vec:8.3f} s  ({len(new)} peaks)")
+    print(f"speedup     : {t_loop / t_vec:8.1f}x")
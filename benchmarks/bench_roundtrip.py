@@ -0,0 +1,57 @@
+# End-to-end Toggle.run_once against pipe_server.py: export, decode, detect, render and
+# import of a synthetic drum track, plus the bare round-trip time of one pipe command.
+# Run from the repo root (Linux/macOS, with Audacity closed):
+#   python benchmarks/bench_roundtrip.py [seconds] [latency_ms]
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from pydub import AudioSegment
+
+SECONDS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+LATENCY_MS = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+FRAME_RATE = 44100
+PINGS = 2000
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pipe_server
+
+def drum_track(path, seconds, frame_rate, seed=0):
+    # quiet noise bed with a decaying noise burst every 250 ms, stereo 16-bit
+    rng = np.random.default_rng(seed)
+    x = rng.normal(0.0, 0.02, seconds * frame_rate)
+    hit = rng.normal(0.0, 0.5, 2000) * np.exp(-np.arange(2000) / 300.0)
+    for start in range(0, len(x) - len(hit), frame_rate // 4):
+        x[start:start + len(hit)] += hit
+    pcm = (np.clip(x, -1, 1) * 32767).astype(np.int16)
+    AudioSegment(np.repeat(pcm, 2).tobytes(), sample_width=2, frame_rate=frame_rate,
+                 channels=2).export(path, format="wav")
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+if __name__ == "__main__":
+    workdir = tempfile.mkdtemp()
+    source = os.path.join(workdir, "source.wav")
+    drum_track(source, SECONDS, FRAME_RATE)
+    server = pipe_server.start(source, LATENCY_MS)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import Toggle
+            t_ping = timed(lambda: [Toggle.do_command("SelectAll:") for _ in range(PINGS)]) / PINGS
+            t_modes = {mode: timed(Toggle.run_once, mode) for mode in ("isolate", "silence", "labels")}
+
+        print(f"{SECONDS}s stereo @ {FRAME_RATE} Hz, {LATENCY_MS} ms per command")
+        print(f"pipe round trip : {t_ping * 1000:8.3f} ms")
+        for mode, t in t_modes.items():
+            print(f"run_once {mode:7s}: {t:8.3f} s")
+    finally:
+        pipe_server.stop(server)
+        os.remove(source)
+        os.rmdir(workdir)
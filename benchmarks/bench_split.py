@@ -0,0 +1,44 @@
+# Split-at-peaks over the scripting pipe: one blocking do_command per command vs
+# Toggle.split_at_peaks pipelining them in batches, against pipe_server.py answering
+# every command after LATENCY_MS.
+# Run from the repo root (Linux/macOS, with Audacity closed): python benchmarks/bench_split.py [latency_ms]
+import contextlib
+import io
+import os
+import sys
+import time
+import numpy as np
+
+HITS = 5000
+FRAME_RATE = 44100
+LATENCY_MS = float(sys.argv[1]) if len(sys.argv) > 1 else 0.0  # per-command processing time in the stand-in
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pipe_server
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - t0
+
+if __name__ == "__main__":
+    server = pipe_server.start(os.devnull, LATENCY_MS)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import Toggle
+
+        rng = np.random.default_rng(0)
+        peaks = np.sort(rng.choice(FRAME_RATE * 600, HITS, replace=False))
+        commands = ["SelectAll:"] + Toggle._split_commands(peaks, FRAME_RATE)
+        print(f"{HITS} hits, {len(commands)} commands, {LATENCY_MS} ms per command")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, t_block = timed(lambda: [Toggle.do_command(c) for c in commands])
+            _, t_pipe = timed(Toggle.split_at_peaks, peaks, FRAME_RATE, Toggle.SPLIT_BATCH)
+
+        print(f"blocking do_command : {t_block:8.3f} s")
+        print(f"split_at_peaks      : {t_pipe:8.3f} s")
+        print(f"speedup             : {t_block / t_pipe:8.1f}x")
+    finally:
+        pipe_server.stop(server)
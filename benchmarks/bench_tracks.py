@@ -0,0 +1,55 @@
+# Multi-track processing: export -> detect/render -> import one track after another vs
+# Toggle.run_tracks overlapping exports with DSP in a process pool, against pipe_server.py
+# serving TRACKS synthetic stems.
+# Run from the repo root (Linux/macOS, with Audacity closed):
+#   python benchmarks/bench_tracks.py [tracks] [seconds] [latency_ms]
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+TRACKS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+SECONDS = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+LATENCY_MS = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+FRAME_RATE = 44100
+MODE = "isolate"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pipe_server
+from bench_roundtrip import drum_track
+import Toggle
+
+def sequential(mode):
+    with Toggle.exchange_dir() as job:
+        for index, name, channels in Toggle.list_tracks():
+            path = Toggle._export_track(index, os.path.join(job, f"track{index}.wav"), channels)
+            out, _ = Toggle._process_track(path, mode, job, f"{index}-{name}-")
+            Toggle.do_command(f'Import2: Filename="{out}"')
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+if __name__ == "__main__":
+    workdir = tempfile.mkdtemp()
+    sources = [os.path.join(workdir, f"stem{i}.wav") for i in range(TRACKS)]
+    for i, path in enumerate(sources):
+        drum_track(path, SECONDS, FRAME_RATE, seed=i)
+    server = pipe_server.start(sources, LATENCY_MS)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            t_seq = timed(sequential, MODE)
+            t_par = timed(Toggle.run_tracks, MODE)
+
+        print(f"{TRACKS} stereo stems of {SECONDS}s @ {FRAME_RATE} Hz, {LATENCY_MS} ms per command")
+        print(f"one track at a time : {t_seq:8.3f} s")
+        print(f"run_tracks          : {t_par:8.3f} s")
+        print(f"speedup             : {t_seq / t_par:8.1f}x")
+    finally:
+        pipe_server.stop(server)
+        shutil.rmtree(workdir)
@@ -0,0 +1,174 @@
+# Stand-in for Audacity's mod-script-pipe, for benchmarks and offline runs of Toggle.py.
+# Creates the two FIFOs Toggle expects and answers commands with the same framing
+# (reply lines, "BatchCommand finished: OK", blank line). Each source WAV is one track:
+# GetInfo Type=Tracks lists them, SelectTracks picks one, Export2 writes the selected track
+# (the first by default, downmixed when NumChannels asks for it) and Import2 checks the file
+# exists and, for WAVs, that the header is sound and the data chunk complete, using the wave
+# module (or a separate check for float WAVs) rather than Toggle's own parser; every other
+# command is acknowledged. Each command waits latency_ms first to mimic Audacity's own work.
+# Time selection is not modelled: SelectAll/SelectTime are only acknowledged, every track
+# starts at 0 and Export2 always writes the whole track, so the offsets Toggle adds for
+# projects that start later are never exercised here.
+# Run (Linux/macOS, with Audacity closed):
+#   python benchmarks/pipe_server.py source.wav[,track2.wav,...] [latency_ms]
+import json
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import time
+import wave
+
+TONAME = f'/tmp/audacity_script_pipe.to.{os.getuid()}'
+FROMNAME = f'/tmp/audacity_script_pipe.from.{os.getuid()}'
+
+PARAM = re.compile(r'(\w+)=(?:"([^"]*)"|(\S+))')
+
+def parse(line):
+    # 'Export2: Filename="a b.wav" NumChannels=1' -> ("Export2", {"Filename": "a b.wav", ...})
+    name, _, rest = line.partition(':')
+    return name.strip(), {k: quoted if quoted else bare for k, quoted, bare in PARAM.findall(rest)}
+
+class StandIn:
+    def __init__(self, sources, latency_ms=0.0):
+        self.sources = sources.split(",") if isinstance(sources, str) else list(sources)
+        self.latency = latency_ms / 1000.0
+        self.selected = 0
+        self.commands = 0
+        self.imported = []
+
+    def get_info(self, params):
+        import wave
+        tracks = []
+        for path in self.sources:
+            with wave.open(path) as w:
+                tracks.append({"name": os.path.splitext(os.path.basename(path))[0], "kind": "wave",
+                               "start": 0.0, "end": w.getnframes() / w.getframerate(),
+                               "channels": w.getnchannels()})
+        return json.dumps(tracks) + "\n"
+
+    def select_tracks(self, params):
+        self.selected = int(params.get("Track", 0))
+        return ""
+
+    def export2(self, params):
+        from pydub import AudioSegment
+        path = params["Filename"]
+        source = self.sources[self.selected]
+        channels = int(params.get("NumChannels", 0))
+        audio = AudioSegment.from_wav(source)
+        if channels and channels != audio.channels:
+            audio.set_channels(channels).export(path, format="wav")
+        else:
+            shutil.copyfile(source, path)
+        return f"Exported to {path}\n"
+
+    def check_wav(self, path):
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            riff, riff_size, form = struct.unpack('<4sI4s', f.read(12).ljust(12, b'\0'))
+            if riff != b'RIFF' or form != b'WAVE':
+                raise ValueError(f"{path} is not a RIFF/WAVE file")
+            if riff_size != size - 8:
+                raise ValueError(f"{path}: RIFF size {riff_size} does not match the file ({size - 8} bytes)")
+            chunks = {}
+            while b'data' not in chunks:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError(f"{path}: no fmt/data chunks")
+                cid, length = struct.unpack('<4sI', header)
+                chunks[cid] = (f.tell(), length, f.read(min(length, 40)) if cid == b'fmt ' else b'')
+                f.seek(chunks[cid][0] + length + (length & 1))
+        fmt = chunks.get(b'fmt ', (0, 0, b''))[2]
+        if len(fmt) >= 16 and struct.unpack_from('<H', fmt)[0] == 3:
+            self.check_float(path, size, fmt, chunks.get(b'data'))
+            return
+        with wave.open(path) as w:  # PCM: let the stdlib parse it
+            frames, frame_bytes = w.getnframes(), w.getnchannels() * w.getsampwidth()
+            if chunks[b'data'][1] % frame_bytes or len(w.readframes(frames)) != frames * frame_bytes:
+                raise ValueError(f"{path}: data chunk truncated or not whole frames")
+
+    def check_float(self, path, size, fmt, data):
+        # The wave module only reads PCM, so IEEE float headers are checked by hand
+        _, channels, rate, byte_rate, block_align, bits = struct.unpack_from('<HHIIHH', fmt)
+        if channels == 0 or bits not in (32, 64) or block_align != channels * bits // 8 \
+                or byte_rate != rate * block_align:
+            raise ValueError(f"{path}: inconsistent float format chunk")
+        if data is None:
+            raise ValueError(f"{path}: no data chunk")
+        offset, length, _ = data
+        if length % block_align or offset + length > size:
+            raise ValueError(f"{path}: data chunk truncated or not whole frames")
+
+    def import2(self, params):
+        path = params["Filename"]
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        if path.lower().endswith(".wav"):
+            self.check_wav(path)
+        self.imported.append((path, os.path.getsize(path)))
+        return f"Imported {path}\n"
+
+    def handle(self, line):
+        if self.latency:
+            time.sleep(self.latency)
+        self.commands += 1
+        name, params = parse(line)
+        handler = {"GetInfo": self.get_info, "SelectTracks": self.select_tracks,
+                   "Export2": self.export2, "Import2": self.import2}.get(name)
+        try:
+            body = handler(params) if handler else ""
+            return body + "BatchCommand finished: OK\n\n"
+        except Exception as e:
+            return f"{name} failed: {e}\nBatchCommand finished: Failed!\n\n"
+
+    def serve(self, to_name=TONAME, from_name=FROMNAME):
+        # One client at a time; after it hangs up, wait for the next one
+        while True:
+            with open(to_name) as to_srv, open(from_name, 'w') as from_srv:
+                try:
+                    for line in to_srv:
+                        if line.strip():
+                            from_srv.write(self.handle(line.strip()))
+                            from_srv.flush()
+                except BrokenPipeError:
+                    pass
+
+def start(sources, latency_ms=0.0, to_name=TONAME, from_name=FROMNAME):
+    # Creates the FIFOs and runs the stand-in in a child process; stop() undoes both
+    if os.path.exists(to_name) or os.path.exists(from_name):
+        raise FileExistsError("Audacity pipes already exist; close Audacity first")
+    os.mkfifo(to_name)
+    os.mkfifo(from_name)
+    if not isinstance(sources, str):
+        sources = ",".join(sources)
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), sources, str(latency_ms),
+                             to_name, from_name])
+
+def stop(server, to_name=TONAME, from_name=FROMNAME):
+    server.kill()
+    server.wait()
+    for path in (to_name, from_name):
+        if os.path.exists(path):
+            os.remove(path)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: pipe_server.py source.wav[,track2.wav,...] [latency_ms]")
+    source = sys.argv[1]
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    if len(sys.argv) > 4:  # started by start(), which owns the FIFOs
+        StandIn(source, latency).serve(sys.argv[3], sys.argv[4])
+    else:
+        os.mkfifo(TONAME)
+        os.mkfifo(FROMNAME)
+        print(f"Serving {source} on {TONAME} / {FROMNAME}, {latency} ms per command")
+        try:
+            StandIn(source, latency).serve()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(TONAME)
+            os.remove(FROMNAME)